@@ -0,0 +1,7 @@
+-- Claim marker for VideoProcessor.claim_pending_products.
+-- A worker stamps the rows it takes (UPDATE ... FOR UPDATE SKIP LOCKED) so
+-- concurrent runs never process the same product; stale claims expire after
+-- CLAIM_TIMEOUT_MINUTES and are picked up again.
+ALTER TABLE public.products
+    ADD COLUMN IF NOT EXISTS merge_status_claimed_at TIMESTAMPTZ;
+
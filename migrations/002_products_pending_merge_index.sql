@@ -0,0 +1,6 @@
+-- Keeps the pending-products subquery in claim_pending_products cheap.
+-- CREATE INDEX CONCURRENTLY cannot run inside a transaction block: apply this
+-- file on its own, without psql -1 / --single-transaction.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS products_pending_merge_idx
+    ON public.products (id)
+    WHERE merge_status = FALSE AND crawl_status = TRUE;
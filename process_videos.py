@@ -5,27 +5,129 @@ Database-driven video processing with cloud storage integration
 """
 
 import os
+import re
 import sys
+import io
 import json
+import asyncio
+import textwrap
 import subprocess
 import psycopg2
-from psycopg2.extras import RealDictCursor
+import psycopg2.pool
+from psycopg2.extras import RealDictCursor, execute_values
 import boto3
+from boto3.s3.transfer import TransferConfig
 from botocore.client import Config
-from datetime import datetime
+from datetime import datetime, timezone
+import atexit
 import logging
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import Callable, Dict, List, Optional, Tuple
 import tempfile
+import time
 import shutil
+import queue
+import threading
+from collections import deque
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+import requests
+import edge_tts
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# The product each worker thread is working on; several products are processed at once
+_log_context = threading.local()
+
+
+class ProductLogFilter(logging.Filter):
+    """Expose the current thread's product as %(product)s so interleaved log lines can be told apart"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        product_id = getattr(_log_context, 'product_id', None)
+        record.product = f"[product {product_id}] " if product_id is not None else ''
+        return True
+
+
+def set_log_product(product_id: Optional[int]):
+    """Tag log lines from the calling thread with a product id (None clears it)"""
+    _log_context.product_id = product_id
+
 
 # Setup logging
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
+    format='%(asctime)s - %(levelname)s - %(product)s%(message)s'
 )
+for _handler in logging.getLogger().handlers:
+    _handler.addFilter(ProductLogFilter())
 logger = logging.getLogger(__name__)
 
+# Progress lines are logged at debug level but kept out of the error tail
+FFMPEG_PROGRESS_RE = re.compile(r'frame=\s*(?P<frame>\d+)\s+fps=\s*(?P<fps>[\d.]+)')
+FFMPEG_STDERR_TAIL_LINES = 20
+
+# Every clip is scaled/padded to this portrait frame before concatenation when re-encoding
+OUTPUT_WIDTH, OUTPUT_HEIGHT, OUTPUT_FPS = 1080, 1920, 30
+NORMALIZE_FILTER = (
+    f"scale={OUTPUT_WIDTH}:{OUTPUT_HEIGHT}:force_original_aspect_ratio=decrease,"
+    f"pad={OUTPUT_WIDTH}:{OUTPUT_HEIGHT}:(ow-iw)/2:(oh-ih)/2,setsar=1,"
+    f"fps={OUTPUT_FPS},format=yuv420p"
+)
+
+# Box types accepted at offset 4 of a downloaded file as a cheap MP4 check
+MP4_BOX_TYPES = (b'ftyp', b'moov')
+
+# Video encoder profiles, selected with VIDEO_ENCODER
+# global_args go before the inputs, filter is appended to the last video filter chain,
+# hwaccel enables GPU decoding of the inputs
+VIDEO_ENCODERS = {
+    'h264_nvenc': {
+        'hwaccel': True,
+        'args': ['-c:v', 'h264_nvenc', '-preset', 'p4', '-rc', 'vbr', '-cq', '23', '-b:v', '0'],
+    },
+    'h264_qsv': {
+        'hwaccel': True,
+        'args': ['-c:v', 'h264_qsv', '-preset', 'medium', '-global_quality', '23'],
+    },
+    'h264_vaapi': {
+        'hwaccel': True,
+        'global_args': ['-vaapi_device', '/dev/dri/renderD128'],
+        'filter': 'format=nv12,hwupload',
+        'args': ['-c:v', 'h264_vaapi', '-qp', '23'],
+    },
+    'svtav1': {
+        'args': ['-c:v', 'libsvtav1', '-preset', '8', '-crf', '32'],
+    },
+    # Software fallback; args come from X264_PRESET / X264_CRF (see VideoProcessor.x264_args)
+    'libx264': {},
+}
+
+
+@dataclass
+class Job:
+    """A single product moving through the processing pipeline"""
+    product_id: int
+    video_data: Dict
+    workdir: Path
+    stage: int = 0
+    failed: bool = False
+    r2_url: Optional[str] = None
+    pending_branches: int = 0
+    script: Optional[str] = None
+    overlay: Optional[str] = None
+    voiceover: Optional[Path] = None
+
+    @property
+    def videos_dir(self) -> Path:
+        """Downloaded source clips"""
+        return self.workdir / 'videos'
+
+    @property
+    def output_dir(self) -> Path:
+        """Merged video, voiceover and final render"""
+        return self.workdir / 'output'
+
 
 class VideoProcessor:
     """Main video processing class"""
@@ -52,11 +154,48 @@ class VideoProcessor:
         self.huggingface_api_key = os.getenv('HUGGINGFACE_API_KEY')
         self.zalo_api_key = os.getenv('ZALO_API_KEY')
 
-        # Working directories
-        self.base_dir = Path(__file__).parent
-        self.videos_dir = self.base_dir / 'videos'
-        self.output_dir = self.base_dir / 'output'
-        self.scripts_dir = self.base_dir / 'scripts'
+        # Pipeline config
+        self.max_jobs = int(os.getenv('PIPELINE_JOBS', '4'))
+        self.cpu_workers = max(1, (os.cpu_count() or 2) // 2)
+        # One db worker, so batched merge_status writes never race each other
+        self.db_workers = 1
+
+        # libx264 settings: speed/quality trade-off is tunable per deployment
+        self.x264_args = [
+            '-c:v', 'libx264',
+            '-preset', os.getenv('X264_PRESET', 'veryfast'),
+            '-crf', os.getenv('X264_CRF', '24'),
+            '-tune', 'fastdecode',
+            '-g', '60'
+        ]
+
+        # Video encoder (hardware encoders fall back to libx264 when unavailable)
+        self.video_encoder = self._select_video_encoder(os.getenv('VIDEO_ENCODER', 'h264_nvenc'))
+        logger.info(f"Using video encoder: {self.video_encoder}")
+
+        # Database connections are shared by the pipeline's worker threads. getconn() raises
+        # instead of waiting, so leave one per thread that can hold one: io workers
+        # (crawl_status), db workers (merge_status) and the dispatcher (claims)
+        self.db_pool = psycopg2.pool.ThreadedConnectionPool(
+            1, self.max_jobs + self.db_workers + 1, dsn=self.db_url
+        )
+        atexit.register(self.db_pool.closeall)
+
+        # Products are claimed in batches; a claim expires so crashed runs get retried,
+        # and run() renews the claims it still holds well before that
+        self.claim_batch_size = int(os.getenv('CLAIM_BATCH_SIZE', '20'))
+        self.claim_timeout_minutes = int(os.getenv('CLAIM_TIMEOUT_MINUTES', '30'))
+
+        # Successful products are marked merged in batches of (id, r2_url, processed_at)
+        self.merge_update_batch_size = 50
+        self._pending_updates: List[Tuple[int, str, datetime]] = []
+        self._pending_updates_lock = threading.Lock()
+
+        # ffprobe results per file, so each file is probed at most once; concurrent
+        # callers for the same file wait on its lock instead of probing it again
+        self._probe_cache: Dict[Path, Dict] = {}
+        self._probe_locks: Dict[Path, threading.Lock] = {}
+        self._probe_cache_lock = threading.Lock()
 
         # Initialize R2 client
         self.r2_client = boto3.client(
@@ -67,250 +206,365 @@ class VideoProcessor:
             config=Config(signature_version='s3v4')
         )
 
-    def setup_directories(self):
-        """Create necessary working directories"""
-        for directory in [self.videos_dir, self.output_dir, self.scripts_dir]:
-            directory.mkdir(exist_ok=True)
-            logger.info(f"Directory ready: {directory}")
-
-    def cleanup_directories(self):
-        """Clean up working directories"""
-        for directory in [self.videos_dir, self.output_dir]:
-            if directory.exists():
-                shutil.rmtree(directory)
-                directory.mkdir(exist_ok=True)
-        logger.info("Cleaned up working directories")
-
-    def get_pending_products(self) -> List[Dict]:
-        """Fetch products from database where merge_status=FALSE and crawl_status=TRUE"""
-        try:
-            conn = psycopg2.connect(self.db_url)
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
-
-            query = """
-                SELECT id, video_data
-                FROM public.products
-                WHERE merge_status = FALSE AND crawl_status = TRUE
-                ORDER BY id
-            """
+        # Shared HTTP client: keep-alive and TLS sessions are reused across all videos and products
+        self.http = requests.Session()
+        http_adapter = HTTPAdapter(
+            pool_connections=16,
+            pool_maxsize=32,
+            max_retries=Retry(
+                total=3,
+                backoff_factor=0.5,
+                status_forcelist=[429, 500, 502, 503, 504],
+                raise_on_status=False
+            )
+        )
+        self.http.mount('http://', http_adapter)
+        self.http.mount('https://', http_adapter)
+        # Use headers to bypass Shopee restrictions
+        self.http.headers.update({
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+            'Referer': 'https://shopee.vn/',
+            'Accept': 'video/webm,video/ogg,video/*;q=0.9,application/ogg;q=0.7,audio/*;q=0.6,*/*;q=0.5',
+            'Accept-Language': 'vi-VN,vi;q=0.9,en-US;q=0.8,en;q=0.7'
+        })
+
+        # Stream the final encode straight into R2 (fragmented MP4) instead of writing it to disk first
+        self.stream_upload = os.getenv('R2_STREAM_UPLOAD', 'true').lower() not in ('0', 'false', 'no')
+
+        # Upload large videos as concurrent 8 MB multipart chunks
+        self.r2_transfer_config = TransferConfig(
+            multipart_threshold=8 * 1024 * 1024,
+            multipart_chunksize=8 * 1024 * 1024,
+            max_concurrency=10,
+            use_threads=True
+        )
 
-            cursor.execute(query)
-            products = cursor.fetchall()
+    def _select_video_encoder(self, requested: str) -> str:
+        """Return the requested encoder if ffmpeg can actually use it, else libx264"""
+        if requested == 'libx264':
+            return requested
 
-            cursor.close()
-            conn.close()
+        if requested not in VIDEO_ENCODERS:
+            logger.warning(f"Unknown VIDEO_ENCODER '{requested}', using libx264")
+            return 'libx264'
 
-            logger.info(f"Found {len(products)} pending products")
-            return products
+        profile = VIDEO_ENCODERS[requested]
+        try:
+            result = subprocess.run(['ffmpeg', '-hide_banner', '-encoders'], capture_output=True, text=True)
+            if requested not in result.stdout:
+                logger.info(f"{requested} not available in ffmpeg, using libx264")
+                return 'libx264'
+
+            # Encoders can be compiled in without a usable device, so try a tiny encode
+            test_filter = ['-vf', profile['filter']] if 'filter' in profile else []
+            result = subprocess.run(
+                ['ffmpeg', '-hide_banner', '-v', 'error'] + profile.get('global_args', []) +
+                ['-f', 'lavfi', '-i', 'color=size=256x256:duration=0.1'] + test_filter +
+                profile['args'] + ['-f', 'null', '-'],
+                capture_output=True, text=True
+            )
+            if result.returncode != 0:
+                logger.info(f"{requested} has no usable device, using libx264")
+                return 'libx264'
 
         except Exception as e:
-            logger.error(f"Database error: {e}")
-            raise
+            logger.warning(f"Could not check {requested} support ({e}), using libx264")
+            return 'libx264'
 
-    def update_merge_status(self, product_id: int, r2_url: str):
-        """Update merge_status to TRUE after successful processing"""
-        try:
-            conn = psycopg2.connect(self.db_url)
-            cursor = conn.cursor()
+        return requested
 
-            query = """
-                UPDATE public.products
-                SET merge_status = TRUE,
-                    r2_video_url = %s,
-                    processed_at = NOW()
-                WHERE id = %s
-            """
+    def _encoder_global_args(self) -> List[str]:
+        """ffmpeg options that must precede the inputs for the selected encoder"""
+        return VIDEO_ENCODERS[self.video_encoder].get('global_args', [])
 
-            cursor.execute(query, (r2_url, product_id))
-            conn.commit()
+    def _encoder_input_args(self) -> List[str]:
+        """Per-input options: decode on the GPU when a hardware encoder is in use"""
+        # Frames are copied back to system memory because trim/concat/drawtext run on the CPU
+        return ['-hwaccel', 'auto'] if VIDEO_ENCODERS[self.video_encoder].get('hwaccel') else []
 
-            cursor.close()
-            conn.close()
+    def _encoder_filter(self, chain: str) -> str:
+        """Append the selected encoder's upload filter to a video filter chain"""
+        upload = VIDEO_ENCODERS[self.video_encoder].get('filter')
+        return f"{chain},{upload}" if upload else chain
 
-            logger.info(f"Updated product {product_id} merge_status to TRUE")
+    def _encoder_output_args(self) -> List[str]:
+        """Video codec options for the selected encoder"""
+        if self.video_encoder == 'libx264':
+            return self.x264_args
+        return VIDEO_ENCODERS[self.video_encoder]['args']
 
-        except Exception as e:
-            logger.error(f"Failed to update database: {e}")
-            raise
+    def _start_ffmpeg(self, command: List[str], stdout=subprocess.DEVNULL) -> Tuple[subprocess.Popen, Callable[[], str]]:
+        """
+        Start ffmpeg with stderr streamed to the debug log by a background thread
+        Returns: (process, function that waits for stderr to drain and returns its last lines)
+        """
+        process = subprocess.Popen(
+            command, stdin=subprocess.DEVNULL, stdout=stdout, stderr=subprocess.PIPE
+        )
+        tail = deque(maxlen=FFMPEG_STDERR_TAIL_LINES)
+        product_id = getattr(_log_context, 'product_id', None)
+
+        def pump():
+            set_log_product(product_id)
+            # Progress lines end in \r, which text mode treats as a line break
+            for line in io.TextIOWrapper(process.stderr, errors='replace'):
+                line = line.rstrip()
+                if not line:
+                    continue
+                progress = FFMPEG_PROGRESS_RE.search(line)
+                if progress:
+                    logger.debug(f"ffmpeg progress: frame {progress['frame']} @ {progress['fps']} fps")
+                else:
+                    logger.debug(f"ffmpeg: {line}")
+                    tail.append(line)
 
-    def update_crawl_status(self, product_id: int, status: bool = False):
-        """Update crawl_status (set to FALSE when videos are invalid/expired)"""
-        try:
-            conn = psycopg2.connect(self.db_url)
-            cursor = conn.cursor()
+        reader = threading.Thread(target=pump, daemon=True)
+        reader.start()
 
-            query = """
-                UPDATE public.products
-                SET crawl_status = %s
-                WHERE id = %s
-            """
+        def stderr_tail() -> str:
+            reader.join()
+            return '\n'.join(tail)
 
-            cursor.execute(query, (status, product_id))
-            conn.commit()
+        return process, stderr_tail
 
-            cursor.close()
-            conn.close()
+    def _run_ffmpeg(self, command: List[str]) -> Tuple[int, str]:
+        """Run ffmpeg to completion. Returns: (exit code, last lines of stderr)"""
+        process, stderr_tail = self._start_ffmpeg(command)
+        returncode = process.wait()
+        return returncode, stderr_tail()
 
-            logger.info(f"Updated product {product_id} crawl_status to {status}")
+    def create_job(self, product_id: int, video_data: Dict) -> Job:
+        """Create a job with its own working directory"""
+        job = Job(product_id, video_data, Path(tempfile.mkdtemp(prefix=f'prod_{product_id}_')))
+        for directory in [job.videos_dir, job.output_dir]:
+            directory.mkdir()
+        return job
 
-        except Exception as e:
-            logger.error(f"Failed to update crawl_status: {e}")
-            raise
+    def release_job(self, job: Job):
+        """Remove a job's working directory and its cached probe results"""
+        shutil.rmtree(job.workdir, ignore_errors=True)
+        self._forget_probes(job.workdir)
 
-    def process_product(self, product_id: int, video_data: Dict) -> Optional[str]:
+    def claim_pending_products(self, batch_size: int) -> List[Dict]:
         """
-        Process a single product: download videos, merge, add audio/text, upload to R2
-        Returns R2 URL if successful, None otherwise
+        Claim up to batch_size products where merge_status=FALSE and crawl_status=TRUE
+        Rows locked or recently claimed by another worker are skipped
+        Only productInfo and videos are returned from video_data
         """
         try:
-            # Validate video_data is not None
-            if video_data is None:
-                logger.error(f"Product {product_id}: video_data is NULL - skipping")
-                return None
+            conn = self.db_pool.getconn()
+            try:
+                with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                    query = """
+                        UPDATE public.products
+                        SET merge_status_claimed_at = NOW()
+                        WHERE id IN (
+                            SELECT id
+                            FROM public.products
+                            WHERE merge_status = FALSE AND crawl_status = TRUE
+                              AND (merge_status_claimed_at IS NULL
+                                   OR merge_status_claimed_at < NOW() - %s * INTERVAL '1 minute')
+                            ORDER BY id
+                            LIMIT %s
+                            FOR UPDATE SKIP LOCKED
+                        )
+                        RETURNING id,
+                            CASE WHEN video_data IS NOT NULL THEN json_build_object(
+                                'productInfo', COALESCE(video_data->'productInfo', '{}'),
+                                'videos', video_data->'videos'
+                            ) END AS video_data
+                    """
+
+                    cursor.execute(query, (self.claim_timeout_minutes, batch_size))
+                    products = sorted(cursor.fetchall(), key=lambda product: product['id'])
+                conn.commit()
+            finally:
+                self.db_pool.putconn(conn)
+
+            logger.info(f"Claimed {len(products)} pending products")
+            return products
 
-            # Validate video_data has required structure
-            if not isinstance(video_data, dict):
-                logger.error(f"Product {product_id}: video_data is not a dict - skipping")
-                return None
+        except Exception as e:
+            logger.error(f"Database error: {e}")
+            raise
 
-            # Validate has videos array
-            videos = video_data.get('videos', [])
-            if not videos or not isinstance(videos, list) or len(videos) == 0:
-                logger.error(f"Product {product_id}: no videos found in video_data - skipping")
-                return None
-
-            product_name = video_data.get('productInfo', {}).get('name', 'Unknown')
-            logger.info(f"Processing product {product_id}: {product_name}")
-
-            # Save video data to JSON file for existing scripts to use
-            video_data_file = self.base_dir / 'video-data.json'
-            with open(video_data_file, 'w', encoding='utf-8') as f:
-                json.dump(video_data, f, ensure_ascii=False, indent=2)
-
-            # Download videos
-            download_success, error_code = self.download_videos(video_data)
-            if not download_success:
-                # If videos are expired/not found (404), update crawl_status to FALSE
-                if error_code == '404':
-                    logger.warning(f"Product {product_id}: Videos not found (404) - updating crawl_status to FALSE for re-crawling")
-                    try:
-                        self.update_crawl_status(product_id, False)
-                    except Exception as e:
-                        logger.error(f"Failed to update crawl_status: {e}")
-                return None
+    def refresh_claims(self, product_ids: List[int]):
+        """Renew the claim on products that are queued, in progress or waiting for their merge_status write"""
+        if not product_ids:
+            return
 
-            # Process videos (trim)
-            if not self.process_videos(video_data):
-                return None
+        try:
+            conn = self.db_pool.getconn()
+            try:
+                with conn.cursor() as cursor:
+                    query = """
+                        UPDATE public.products
+                        SET merge_status_claimed_at = NOW()
+                        WHERE id = ANY(%s) AND merge_status = FALSE
+                    """
+
+                    cursor.execute(query, (product_ids,))
+                conn.commit()
+            finally:
+                self.db_pool.putconn(conn)
+
+            logger.info(f"Renewed claims on {len(product_ids)} products")
+
+        except Exception as e:
+            logger.error(f"Failed to renew claims: {e}")
+            raise
 
-            # Merge videos
-            if not self.merge_videos(video_data):
-                return None
+    def update_merge_status(self, product_id: int, r2_url: str) -> bool:
+        """
+        Queue merge_status=TRUE for a processed product; written in batches
+        Returns: True once a full batch is waiting for flush_merge_updates()
+        """
+        with self._pending_updates_lock:
+            self._pending_updates.append((product_id, r2_url, datetime.now(timezone.utc)))
+            return len(self._pending_updates) >= self.merge_update_batch_size
 
-            # Generate AI script
-            if not self.generate_script(video_data_file):
-                return None
+    def _flush_merge_updates_in_background(self):
+        """flush_merge_updates() for the db pool; a failed batch stays queued for the next flush"""
+        try:
+            self.flush_merge_updates()
+        except Exception:
+            # Already logged
+            pass
 
-            # Generate audio
-            if not self.generate_audio():
-                return None
+    def flush_merge_updates(self):
+        """Write all queued merge_status updates in a single statement"""
+        with self._pending_updates_lock:
+            updates, self._pending_updates = self._pending_updates, []
 
-            # Add audio to video
-            if not self.add_audio():
-                return None
+        if not updates:
+            return
 
-            # Add text overlay (using AI-generated overlay text)
-            if not self.add_text_overlay(video_data):
-                return None
+        try:
+            conn = self.db_pool.getconn()
+            try:
+                with conn.cursor() as cursor:
+                    query = """
+                        UPDATE public.products AS p
+                        SET merge_status = TRUE,
+                            r2_video_url = v.url,
+                            processed_at = v.ts
+                        FROM (VALUES %s) AS v(id, url, ts)
+                        WHERE p.id = v.id
+                    """
+
+                    execute_values(cursor, query, updates, template="(%s,%s,%s)", page_size=self.merge_update_batch_size)
+                conn.commit()
+            finally:
+                self.db_pool.putconn(conn)
+
+            logger.info(f"Updated merge_status to TRUE for {len(updates)} products: {[u[0] for u in updates]}")
 
-            # Upload to R2
-            final_video = self.output_dir / 'final_merged_video.mp4'
-            r2_url = self.upload_to_r2(final_video, product_id, video_data)
+        except Exception as e:
+            logger.error(f"Failed to update database: {e}")
+            # Keep the updates so the next flush retries them
+            with self._pending_updates_lock:
+                self._pending_updates[:0] = updates
+            raise
+
+    def update_crawl_status(self, product_id: int, status: bool = False):
+        """Update crawl_status (set to FALSE when videos are invalid/expired)"""
+        try:
+            conn = self.db_pool.getconn()
+            try:
+                with conn.cursor() as cursor:
+                    query = """
+                        UPDATE public.products
+                        SET crawl_status = %s
+                        WHERE id = %s
+                    """
+
+                    cursor.execute(query, (status, product_id))
+                conn.commit()
+            finally:
+                self.db_pool.putconn(conn)
 
-            return r2_url
+            logger.info(f"Updated product {product_id} crawl_status to {status}")
 
         except Exception as e:
-            logger.error(f"Error processing product {product_id}: {e}")
-            return None
+            logger.error(f"Failed to update crawl_status: {e}")
+            raise
 
-    def download_videos(self, video_data: Dict) -> Tuple[bool, Optional[str]]:
+    def _stage_download(self, job: Job) -> bool:
+        """Pipeline stage (I/O): download source videos"""
+        download_success, error_code = self.download_videos(job)
+        if not download_success:
+            # If videos are expired/not found (404), update crawl_status to FALSE
+            if error_code == '404':
+                logger.warning(f"Product {job.product_id}: Videos not found (404) - updating crawl_status to FALSE for re-crawling")
+                try:
+                    self.update_crawl_status(job.product_id, False)
+                except Exception as e:
+                    logger.error(f"Failed to update crawl_status: {e}")
+            return False
+        return True
+
+    def _stage_edit(self, job: Job) -> bool:
+        """Pipeline stage (CPU): trim and merge videos"""
+        return self.merge_videos(job)
+
+    def _stage_narrate(self, job: Job) -> bool:
+        """Pipeline stage (I/O): generate AI script and voiceover"""
+        return self.generate_script(job) and self.generate_audio(job)
+
+    def _stage_render(self, job: Job) -> bool:
+        """Pipeline stage (CPU): add voiceover and text overlay"""
+        return self.render_final_video(job)
+
+    def _stage_publish(self, job: Job) -> bool:
+        """Pipeline stage (CPU + I/O): encode the final video while uploading it"""
+        return self.render_and_upload(job)
+
+    def _stage_upload(self, job: Job) -> bool:
+        """Pipeline stage (I/O): upload final video to R2"""
+        final_video = job.output_dir / 'final_merged_video.mp4'
+        job.r2_url = self.upload_to_r2(final_video, job.product_id, job.video_data)
+        return job.r2_url is not None
+
+    def _submit_stage(self, job: Job, branches: List[Tuple[ThreadPoolExecutor, Callable[[Job], bool]]], done: queue.Queue):
+        """Start every branch of a stage on its pool"""
+        job.pending_branches = len(branches)
+        for pool, stage_fn in branches:
+            pool.submit(self._run_stage, job, stage_fn, done)
+
+    def _run_stage(self, job: Job, stage_fn, done: queue.Queue):
+        """Run one stage of a job and hand it back to the dispatcher"""
+        set_log_product(job.product_id)
+        try:
+            if not stage_fn(job):
+                job.failed = True
+        except Exception as e:
+            logger.error(f"Error processing product {job.product_id}: {e}")
+            job.failed = True
+        finally:
+            set_log_product(None)
+            done.put(job)
+
+    def download_videos(self, job: Job) -> Tuple[bool, Optional[str]]:
         """
-        Download all videos from URLs
+        Download all videos from URLs in parallel
         Returns: (success: bool, error_code: Optional[str])
         error_code can be '404', '403', 'invalid', etc.
         """
         try:
-            videos = video_data.get('videos', [])
+            videos = job.video_data.get('videos', [])
             logger.info(f"Downloading {len(videos)} videos...")
 
-            for i, video in enumerate(videos):
-                url = video.get('url')
-                output_path = self.videos_dir / f'video_{i}.mp4'
-
-                # Download with retry
-                max_retries = 3
-                last_http_code = None
-                for retry in range(max_retries):
-                    try:
-                        # Use headers to bypass Shopee restrictions
-                        result = subprocess.run([
-                            'curl', '-L', '-o', str(output_path), url,
-                            '--max-time', '300',
-                            '--connect-timeout', '30',
-                            '-H', 'User-Agent: Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-                            '-H', 'Referer: https://shopee.vn/',
-                            '-H', 'Accept: video/webm,video/ogg,video/*;q=0.9,application/ogg;q=0.7,audio/*;q=0.6,*/*;q=0.5',
-                            '-H', 'Accept-Language: vi-VN,vi;q=0.9,en-US;q=0.8,en;q=0.7',
-                            '-w', '%{http_code}',
-                            '--compressed'
-                        ], capture_output=True, text=True)
-
-                        http_code = result.stdout.strip() if result.stdout else '000'
-                        last_http_code = http_code
-                        logger.info(f"Video {i+1} download HTTP status: {http_code}")
-
-                        # Check if file was created and has content
-                        if not output_path.exists():
-                            raise Exception(f"File was not created (HTTP {http_code})")
-
-                        file_size = output_path.stat().st_size
-                        if file_size == 0:
-                            raise Exception(f"Downloaded file is empty (HTTP {http_code})")
-
-                        if file_size < 1024:  # Less than 1KB is suspicious
-                            logger.warning(f"Video {i+1} file size is very small: {file_size} bytes (HTTP {http_code})")
-                            # Read first bytes to check if it's an error page
-                            with open(output_path, 'rb') as f:
-                                first_bytes = f.read(100)
-                                logger.warning(f"First bytes: {first_bytes[:50]}")
-
-                        # Validate with ffprobe
-                        validate_result = subprocess.run([
-                            'ffprobe', '-v', 'error',
-                            '-show_entries', 'format=duration',
-                            '-of', 'default=noprint_wrappers=1:nokey=1',
-                            str(output_path)
-                        ], capture_output=True, text=True)
-
-                        if validate_result.returncode != 0:
-                            logger.error(f"Video {i+1} validation failed: {validate_result.stderr}")
-                            raise Exception(f"Invalid video file (HTTP {http_code}): {validate_result.stderr}")
-
-                        logger.info(f"Downloaded video {i+1}/{len(videos)} ({file_size} bytes)")
-                        break
+            with ThreadPoolExecutor(max_workers=min(16, len(videos)),
+                                    initializer=set_log_product, initargs=(job.product_id,)) as executor:
+                results = list(executor.map(
+                    lambda item: self._download_one(job.videos_dir, item[0], item[1].get('url'), len(videos)),
+                    enumerate(videos)
+                ))
 
-                    except Exception as download_error:
-                        if retry < max_retries - 1:
-                            logger.warning(f"Download failed ({download_error}), retrying... ({retry+1}/{max_retries})")
-                            # Clean up failed download
-                            if output_path.exists():
-                                output_path.unlink()
-                            continue
-                        else:
-                            logger.error(f"Failed to download video {i+1} after {max_retries} attempts: {download_error}")
-                            logger.error(f"URL: {url}")
-                            # Return error code for proper handling
-                            return (False, last_http_code)
+            # Results come back in clip order, so the first failure is the lowest index
+            for i, ok, http_code in results:
+                if not ok:
+                    return (False, http_code)
 
             return (True, None)
 
@@ -318,112 +572,242 @@ class VideoProcessor:
             logger.error(f"Error downloading videos: {e}")
             return (False, None)
 
-    def process_videos(self, video_data: Dict) -> bool:
-        """Trim 2 seconds from start and end of each video"""
+    def _download_one(self, videos_dir: Path, i: int, url: str, total: int) -> Tuple[int, bool, str]:
+        """
+        Download and validate a single video
+        Returns: (index, success, http_code)
+        """
+        output_path = videos_dir / f'video_{i}.mp4'
+
+        max_retries = 3
+        for retry in range(max_retries):
+            http_code = '000'
+            retryable = False
+            try:
+                with self.http.get(url, stream=True, timeout=(30, 300)) as response:
+                    http_code = str(response.status_code)
+                    logger.info(f"Video {i+1} download HTTP status: {http_code}")
+                    response.raise_for_status()
+                    content_type = response.headers.get('Content-Type', '')
+                    if content_type.startswith('text/'):
+                        # CDN error pages sometimes come back with a 200
+                        raise Exception(f"Unexpected Content-Type {content_type!r} (HTTP {http_code})")
+
+                    # The session already retried connection errors and error statuses; from here on
+                    # a failure (body cut off mid-stream, truncated or invalid file) is retried here
+                    retryable = True
+                    with open(output_path, 'wb') as f:
+                        for chunk in response.iter_content(chunk_size=1 << 20):
+                            f.write(chunk)
+
+                file_size = output_path.stat().st_size
+                if file_size == 0:
+                    raise Exception(f"Downloaded file is empty (HTTP {http_code})")
+
+                if file_size < 1024:  # Less than 1KB is suspicious
+                    logger.warning(f"Video {i+1} file size is very small: {file_size} bytes (HTTP {http_code})")
+                    # Read first bytes to check if it's an error page
+                    with open(output_path, 'rb') as f:
+                        first_bytes = f.read(100)
+                        logger.warning(f"First bytes: {first_bytes[:50]}")
+
+                # An MP4 starts with an ftyp (or moov) box; only fall back to ffprobe for anything else
+                with open(output_path, 'rb') as f:
+                    head = f.read(12)
+                if head[4:8] not in MP4_BOX_TYPES:
+                    logger.warning(f"Video {i+1} has no MP4 header, probing with ffprobe")
+                    try:
+                        self._probe(output_path)
+                    except subprocess.CalledProcessError as e:
+                        logger.error(f"Video {i+1} validation failed: {e.stderr}")
+                        raise Exception(f"Invalid video file (HTTP {http_code}): {e.stderr}")
+
+                logger.info(f"Downloaded video {i+1}/{total} ({file_size} bytes)")
+                return (i, True, http_code)
+
+            except Exception as download_error:
+                # Clean up failed download
+                if output_path.exists():
+                    output_path.unlink()
+
+                if retryable and retry < max_retries - 1:
+                    logger.warning(f"Video {i+1} download failed ({download_error}), retrying... ({retry+1}/{max_retries})")
+                    continue
+
+                logger.error(f"Failed to download video {i+1} after {retry+1} attempts: {download_error}")
+                logger.error(f"URL: {url}")
+                return (i, False, http_code)
+
+    def merge_videos(self, job: Job) -> bool:
+        """Trim 2 seconds from start and end of each video and merge them (stream copy when possible)"""
         try:
-            videos = video_data.get('videos', [])
-            logger.info("Processing videos (trimming)...")
+            videos = job.video_data.get('videos', [])
+            logger.info("Trimming and merging videos...")
 
-            for i in range(len(videos)):
-                input_path = self.videos_dir / f'video_{i}.mp4'
-                output_path = self.videos_dir / f'trimmed_{i}.mp4'
+            input_paths = [job.videos_dir / f'video_{i}.mp4' for i in range(len(videos))]
 
-                # Check if input file exists
+            # Check if input files exist
+            for i, input_path in enumerate(input_paths):
                 if not input_path.exists():
                     logger.error(f"Video {i+1} file not found: {input_path}")
                     return False
 
-                # Get duration
-                try:
-                    result = subprocess.run([
-                        'ffprobe', '-v', 'error',
-                        '-show_entries', 'format=duration',
-                        '-of', 'default=noprint_wrappers=1:nokey=1',
-                        str(input_path)
-                    ], capture_output=True, text=True, check=True)
-
-                    duration = float(result.stdout.strip())
-                except subprocess.CalledProcessError as e:
-                    logger.error(f"ffprobe failed for video {i+1}: {e.stderr}")
-                    return False
-                except ValueError as e:
-                    logger.error(f"Invalid duration for video {i+1}: {result.stdout}")
+            # Probe all inputs up front, concurrently
+            with ThreadPoolExecutor(max_workers=len(input_paths),
+                                    initializer=set_log_product, initargs=(job.product_id,)) as executor:
+                probes = list(executor.map(self._probe, input_paths))
+
+            for i, probe in enumerate(probes):
+                if probe['duration'] == 0:
+                    logger.error(f"Invalid duration for video {i+1}")
                     return False
 
+            output_path = job.output_dir / 'merged_temp.mp4'
+
+            # Source audio is replaced by the voiceover later, so only the video streams have to match.
+            # The output keeps the first clip's SPS/PPS, so the codec extradata must be identical too
+            video_params = {
+                (p['codec'], p['profile'], p['level'], p['width'], p['height'],
+                 p['pix_fmt'], p['frame_rate'], p['extradata_hash'])
+                for p in probes
+            }
+            if len(video_params) == 1 and probes[0]['codec'] == 'h264' and probes[0]['extradata_hash']:
+                return self._concat_copy(job, input_paths, probes, output_path)
+
+            logger.info(f"Video dimensions: {OUTPUT_WIDTH}x{OUTPUT_HEIGHT}")
+            command = ['ffmpeg'] + self._encoder_global_args()
+            filters = []
+            for i, (input_path, probe) in enumerate(zip(input_paths, probes)):
+                duration = probe['duration']
                 new_duration = duration - 4
 
                 if new_duration > 0:
-                    # Trim video
-                    try:
-                        trim_result = subprocess.run([
-                            'ffmpeg', '-i', str(input_path),
-                            '-ss', '2', '-t', str(new_duration),
-                            '-c:v', 'libx264', '-preset', 'medium', '-crf', '23',
-                            '-c:a', 'aac', '-b:a', '128k', '-ar', '48000',
-                            '-r', '30',
-                            '-y', str(output_path)
-                        ], capture_output=True, text=True, check=True)
-
-                        logger.info(f"Trimmed video {i+1}: {duration:.2f}s -> {new_duration:.2f}s")
-                    except subprocess.CalledProcessError as e:
-                        logger.error(f"ffmpeg trim failed for video {i+1}: {e.stderr}")
-                        return False
+                    # Seek past the first 2 seconds on input, trim the last 2 in the graph
+                    command += self._encoder_input_args() + ['-ss', '2', '-i', str(input_path)]
+                    filters.append(f"[{i}:v]trim=duration={new_duration:.3f},setpts=PTS-STARTPTS,{NORMALIZE_FILTER}[v{i}]")
+                    logger.info(f"Trimming video {i+1}: {duration:.2f}s -> {new_duration:.2f}s")
                 else:
                     # Video too short, keep original
-                    shutil.copy(input_path, output_path)
+                    command += self._encoder_input_args() + ['-i', str(input_path)]
+                    filters.append(f"[{i}:v]setpts=PTS-STARTPTS,{NORMALIZE_FILTER}[v{i}]")
                     logger.warning(f"Video {i+1} too short ({duration:.2f}s), keeping original")
 
-            return True
+            # Source audio is replaced by the voiceover later, so only video is concatenated
+            concat_inputs = ''.join(f"[v{i}]" for i in range(len(input_paths)))
+            filters.append(concat_inputs + self._encoder_filter(f"concat=n={len(input_paths)}:v=1:a=0") + "[v]")
 
-        except Exception as e:
-            logger.error(f"Error processing videos: {e}")
-            return False
-
-    def merge_videos(self, video_data: Dict) -> bool:
-        """Merge all trimmed videos into one"""
-        try:
-            logger.info("Merging videos...")
-
-            # Create concat list
-            concat_file = self.videos_dir / 'concat_list.txt'
-            videos = video_data.get('videos', [])
-
-            with open(concat_file, 'w') as f:
-                for i in range(len(videos)):
-                    f.write(f"file 'trimmed_{i}.mp4'\n")
-
-            # Merge with ffmpeg
-            output_path = self.output_dir / 'merged_temp.mp4'
-
-            subprocess.run([
-                'ffmpeg', '-f', 'concat', '-safe', '0',
-                '-i', str(concat_file),
-                '-c:v', 'libx264', '-preset', 'medium', '-crf', '23',
-                '-c:a', 'aac', '-b:a', '128k', '-ar', '48000',
-                '-r', '30',
+            returncode, stderr_tail = self._run_ffmpeg(command + [
+                '-filter_complex', ';'.join(filters),
+                '-map', '[v]'
+            ] + self._encoder_output_args() + [
+                '-an',
                 '-movflags', '+faststart',
                 '-y', str(output_path)
-            ], check=True, capture_output=True)
+            ])
+            if returncode != 0:
+                logger.error(f"Error merging videos (ffmpeg exit {returncode}): {stderr_tail}")
+                return False
 
             logger.info("Videos merged successfully")
             return True
 
+        except subprocess.CalledProcessError as e:
+            logger.error(f"Error merging videos: {e.stderr}")
+            return False
         except Exception as e:
             logger.error(f"Error merging videos: {e}")
             return False
 
+    def _concat_copy(self, job: Job, input_paths: List[Path], probes: List[Dict], output_path: Path) -> bool:
+        """Trim and merge H.264 clips with matching parameters without re-encoding"""
+        logger.info("Inputs share H.264 parameters, merging with stream copy")
+        logger.info(f"Video dimensions: {probes[0]['width']}x{probes[0]['height']}")
+
+        # Cuts snap to keyframes, so trims may be off by up to one GOP
+        concat_file = job.videos_dir / 'concat_list.txt'
+        with open(concat_file, 'w') as f:
+            for i, (input_path, probe) in enumerate(zip(input_paths, probes)):
+                duration = probe['duration']
+                f.write(f"file '{input_path}'\n")
+                if duration - 4 > 0:
+                    f.write(f"inpoint 2\noutpoint {duration - 2:.3f}\n")
+                    logger.info(f"Trimming video {i+1}: {duration:.2f}s -> {duration - 4:.2f}s")
+                else:
+                    logger.warning(f"Video {i+1} too short ({duration:.2f}s), keeping original")
+
+        returncode, stderr_tail = self._run_ffmpeg([
+            'ffmpeg', '-f', 'concat', '-safe', '0',
+            '-i', str(concat_file),
+            '-map', '0:v',
+            '-c', 'copy',
+            '-movflags', '+faststart',
+            '-y', str(output_path)
+        ])
+        if returncode != 0:
+            logger.error(f"Error merging videos (ffmpeg exit {returncode}): {stderr_tail}")
+            return False
+
+        logger.info("Videos merged successfully")
+        return True
+
+    def _probe(self, video_path: Path) -> Dict:
+        """
+        Probe a media file with a single ffprobe call, memoized per path
+        Returns: {duration, width, height, codec, profile, level, pix_fmt, frame_rate, extradata_hash}
+        """
+        with self._probe_cache_lock:
+            cached = self._probe_cache.get(video_path)
+            if cached is not None:
+                return cached
+            path_lock = self._probe_locks.setdefault(video_path, threading.Lock())
+
+        with path_lock:
+            with self._probe_cache_lock:
+                cached = self._probe_cache.get(video_path)
+            if cached is not None:
+                return cached
+            return self._run_probe(video_path)
+
+    def _run_probe(self, video_path: Path) -> Dict:
+        """Run ffprobe on a file and cache the result (callers hold the file's probe lock)"""
+        result = subprocess.run([
+            'ffprobe', '-v', 'error',
+            '-show_streams', '-show_format',
+            '-show_data_hash', 'sha256',
+            '-of', 'json',
+            str(video_path)
+        ], capture_output=True, text=True, check=True)
+
+        data = json.loads(result.stdout)
+        video_stream = next((s for s in data.get('streams', []) if s.get('codec_type') == 'video'), {})
+        info = {
+            'duration': float(data.get('format', {}).get('duration') or 0.0),
+            'width': video_stream.get('width'),
+            'height': video_stream.get('height'),
+            'codec': video_stream.get('codec_name'),
+            'profile': video_stream.get('profile'),
+            'level': video_stream.get('level'),
+            'pix_fmt': video_stream.get('pix_fmt'),
+            'frame_rate': video_stream.get('r_frame_rate'),
+            'extradata_hash': video_stream.get('extradata_hash'),
+        }
+
+        with self._probe_cache_lock:
+            self._probe_cache[video_path] = info
+        return info
+
+    def _forget_probes(self, directory: Path):
+        """Drop cached probe results for files under a (deleted) directory"""
+        with self._probe_cache_lock:
+            for path in [p for p in self._probe_cache if directory in p.parents]:
+                del self._probe_cache[path]
+            for path in [p for p in self._probe_locks if directory in p.parents]:
+                del self._probe_locks[path]
+
     def get_video_duration(self, video_path: Path) -> float:
         """Get video duration in seconds"""
         try:
-            result = subprocess.run([
-                'ffprobe', '-v', 'error',
-                '-show_entries', 'format=duration',
-                '-of', 'default=noprint_wrappers=1:nokey=1',
-                str(video_path)
-            ], capture_output=True, text=True, check=True)
-
-            duration = float(result.stdout.strip())
-            return duration
+            return self._probe(video_path)['duration']
 
         except Exception as e:
             logger.error(f"Error getting video duration: {e}")
@@ -444,14 +828,74 @@ class VideoProcessor:
         logger.info(f"Video duration: {video_duration:.2f}s, Target script length: {target_length} characters")
         return target_length
 
-    def generate_script(self, video_data_file: Path) -> bool:
-        """Generate AI script using existing bash script with calculated target length"""
+    def _estimate_merged_duration(self, job: Job) -> float:
+        """Estimate the merged video duration from the clip probes (2s trimmed from each end)"""
+        videos = job.video_data.get('videos', [])
+        total = 0.0
+        for i in range(len(videos)):
+            duration = self.get_video_duration(job.videos_dir / f'video_{i}.mp4')
+            if duration == 0:
+                return 0.0
+            total += duration - 4 if duration - 4 > 0 else duration
+        return total
+
+    def _script_prompt(self, product_info: Dict, target_length: int, video_duration: float) -> str:
+        """Build the voice-over/overlay prompt for a product"""
+        product_name = product_info.get('name') or ''
+        # Convert price format: 269.000₫ -> 269k
+        price = str(product_info.get('price') or '').replace('.000₫', 'k').replace('₫', 'k')
+        original_price = str(product_info.get('originalPrice') or '').replace('.000₫', 'k').replace('₫', 'k')
+        discount = product_info.get('discount') or ''
+
+        return f"""Hãy tạo 2 phần nội dung cho video TikTok/Reels về sản phẩm sau:
+
+Tên sản phẩm: {product_name}
+Giá hiện tại: {price}
+Giá gốc: {original_price}
+Giảm giá: {discount}
+
+PHẦN 1 - SCRIPT VOICE-OVER:
+Yêu cầu:
+1. QUAN TRỌNG: Script phải có CHÍNH XÁC {target_length} ký tự (bao gồm dấu câu và khoảng trắng) để khớp với video dài {video_duration} giây. Đây là yêu cầu BẮT BUỘC để script nói liền mạch từ đầu đến cuối video.
+2. Giọng điệu hấp dẫn, thu hút khách hàng
+3. Nhấn mạnh các tính năng nổi bật từ tên sản phẩm
+4. Không nói giá chi tiết kiểu '269.000 đồng' mà chỉ nói '269k' hoặc '429k'
+5. Câu cuối cùng PHẢI là: 'Mọi người mua sản phẩm thì ấn vào link ở giỏ hàng nha.'
+6. Viết bằng tiếng Việt tự nhiên, dễ nghe
+7. Không dùng ký tự đặc biệt phức tạp
+8. Đếm chính xác số ký tự để đảm bảo đúng {target_length} ký tự
+
+PHẦN 2 - TEXT OVERLAY:
+Tạo một dòng text ngắn gọn, xúc tích (tối đa 70 ký tự) để hiển thị trên video, tóm tắt điểm nổi bật nhất của sản phẩm.
+Ví dụ: 'Áo thun nam cao cấp - Giảm 37%' hoặc 'Giày sneaker đế êm - Chỉ 269k'
+
+Hãy trả về kết quả dưới dạng JSON với format sau (KHÔNG thêm markdown code block):
+{{
+  "script": "<script voice-over với {target_length} ký tự>",
+  "overlay": "<text overlay ngắn gọn>"
+}}"""
+
+    def _parse_script_response(self, generated_text: str) -> Dict:
+        """Parse the model's JSON answer, also accepting a markdown ```json block"""
+        match = re.search(r'```(?:json)?\s*(\{.*?\})\s*```', generated_text, re.DOTALL)
+        for candidate in [generated_text, match.group(1) if match else None]:
+            if candidate is None:
+                continue
+            try:
+                result = json.loads(candidate)
+            except ValueError:
+                continue
+            if isinstance(result, dict):
+                return result
+        return {}
+
+    def generate_script(self, job: Job) -> bool:
+        """Generate AI voice-over script and overlay text sized to the estimated video duration"""
         try:
             logger.info("Generating AI script...")
 
-            # Get merged video duration
-            merged_video = self.output_dir / 'merged_temp.mp4'
-            video_duration = self.get_video_duration(merged_video)
+            # Estimated from the clip probes so this can run while the clips are being merged
+            video_duration = self._estimate_merged_duration(job)
 
             if video_duration == 0:
                 logger.error("Failed to get video duration")
@@ -460,211 +904,262 @@ class VideoProcessor:
             # Calculate target script length
             target_length = self.calculate_target_script_length(video_duration)
 
-            env = os.environ.copy()
-            env['HUGGINGFACE_ENDPOINT'] = self.huggingface_endpoint
-            env['HUGGINGFACE_MODEL'] = self.huggingface_model
-            env['HUGGINGFACE_API_KEY'] = self.huggingface_api_key
-            env['TARGET_SCRIPT_LENGTH'] = str(target_length)
-            env['VIDEO_DURATION'] = str(video_duration)
+            product_info = job.video_data.get('productInfo') or {}
+            prompt = self._script_prompt(product_info, target_length, round(video_duration, 2))
+
+            response = requests.post(
+                self.huggingface_endpoint,
+                headers={'Authorization': f"Bearer {self.huggingface_api_key}"},
+                json={
+                    'model': self.huggingface_model,
+                    'messages': [{'role': 'user', 'content': prompt}],
+                    'max_tokens': 1000,
+                    'temperature': 0.7
+                },
+                timeout=(30, 300)
+            )
+            response.raise_for_status()
+
+            generated_text = response.json()['choices'][0]['message']['content']
+            if not generated_text:
+                logger.error(f"No text generated from API: {response.text}")
+                return False
+
+            result = self._parse_script_response(generated_text)
+            job.script = result.get('script')
+            job.overlay = result.get('overlay')
 
-            script_path = self.scripts_dir / 'generate-script.sh'
+            if not job.script:
+                logger.error(f"Could not parse script from AI response: {generated_text}")
+                return False
 
-            subprocess.run([
-                'bash', str(script_path), str(video_data_file)
-            ], check=True, env=env, capture_output=True)
+            if not job.overlay:
+                logger.warning("Could not parse overlay text, using product name as fallback")
+                job.overlay = product_info.get('name')
 
-            logger.info("AI script generated successfully")
+            logger.info(f"AI script generated successfully ({len(job.script)} characters)")
             return True
 
         except Exception as e:
             logger.error(f"Error generating script: {e}")
             return False
 
-    def generate_audio(self) -> bool:
-        """Generate audio using existing bash script"""
-        try:
-            logger.info("Generating audio...")
-
-            env = os.environ.copy()
-            if self.zalo_api_key:
-                env['ZALO_API_KEY'] = self.zalo_api_key
+    async def _edge_tts(self, text: str, output_path: Path):
+        """Synthesize speech with Edge-TTS (Vietnamese female voice)"""
+        communicate = edge_tts.Communicate(text, 'vi-VN-HoaiMyNeural')
+        await communicate.save(str(output_path))
+
+    def _zalo_tts(self, text: str, output_path: Path):
+        """Synthesize speech with Zalo TTS and download the result"""
+        response = requests.post(
+            'https://api.zalo.ai/v1/tts/synthesize',
+            headers={'apikey': self.zalo_api_key},
+            data={'speaker_id': '1', 'speed': '1', 'input': text},
+            timeout=(30, 120)
+        )
+        response.raise_for_status()
+        result = response.json()
 
-            script_path = self.scripts_dir / 'generate-audio.sh'
-            text_file = self.scripts_dir / 'generated_script.txt'
+        if result.get('error_code') != 0:
+            raise Exception(f"Zalo API Error: {result.get('error_message')} (code: {result.get('error_code')})")
 
-            subprocess.run([
-                'bash', str(script_path), str(text_file)
-            ], check=True, env=env)
+        audio_url = (result.get('data') or {}).get('url')
+        if not audio_url:
+            raise Exception("No audio URL in Zalo response")
 
-            audio_file = self.output_dir / 'voiceover.wav'
-            if not audio_file.exists():
-                logger.error("Audio file not generated")
-                return False
+        with requests.get(audio_url, stream=True, timeout=(30, 300)) as audio:
+            audio.raise_for_status()
+            with open(output_path, 'wb') as f:
+                for chunk in audio.iter_content(chunk_size=1 << 20):
+                    f.write(chunk)
 
-            logger.info("Audio generated successfully")
-            return True
+    def generate_audio(self, job: Job) -> bool:
+        """Generate voiceover with Edge-TTS, falling back to Zalo TTS"""
+        logger.info(f"Generating audio for text ({len(job.script)} characters)...")
 
+        # Edge-TTS (Primary)
+        audio_file = job.output_dir / 'voiceover.mp3'
+        try:
+            asyncio.run(self._edge_tts(job.script, audio_file))
+            # Anything under 1KB is an empty or invalid audio file
+            if audio_file.exists() and audio_file.stat().st_size >= 1000:
+                job.voiceover = audio_file
+                logger.info("Audio generated successfully with Edge-TTS")
+                return True
+            logger.warning("Edge-TTS generated empty or invalid audio file")
         except Exception as e:
-            logger.error(f"Error generating audio: {e}")
+            logger.warning(f"Edge-TTS failed: {e}")
+
+        # Zalo TTS (Fallback)
+        if not self.zalo_api_key:
+            logger.error("Failed to generate audio: Edge-TTS failed and ZALO_API_KEY is not set")
             return False
 
-    def add_audio(self) -> bool:
-        """Add audio to merged video"""
+        audio_file = job.output_dir / 'voiceover.wav'
         try:
-            logger.info("Adding audio to video...")
-
-            # Normalize audio
-            subprocess.run([
-                'ffmpeg', '-i', str(self.output_dir / 'voiceover.wav'),
-                '-ar', '48000', '-ac', '2', '-c:a', 'aac', '-b:a', '192k',
-                '-y', str(self.output_dir / 'voiceover_normalized.aac')
-            ], check=True, capture_output=True)
-
-            # Add audio to video
-            subprocess.run([
-                'ffmpeg',
-                '-i', str(self.output_dir / 'merged_temp.mp4'),
-                '-i', str(self.output_dir / 'voiceover_normalized.aac'),
-                '-map', '0:v', '-map', '1:a',
-                '-c:v', 'libx264', '-preset', 'medium', '-crf', '23',
-                '-c:a', 'copy',
-                '-shortest',
-                '-y', str(self.output_dir / 'merged_with_audio.mp4')
-            ], check=True, capture_output=True)
-
-            logger.info("Audio added to video successfully")
+            self._zalo_tts(job.script, audio_file)
+            job.voiceover = audio_file
+            logger.info("Audio generated successfully with Zalo TTS")
             return True
-
         except Exception as e:
-            logger.error(f"Error adding audio: {e}")
+            logger.error(f"Failed to generate audio with both Edge-TTS and Zalo TTS: {e}")
             return False
 
-    def add_text_overlay(self, video_data: Dict) -> bool:
-        """Add AI-generated text overlay to video"""
+    def _final_video_command(self, job: Job) -> List[str]:
+        """Build the ffmpeg command that adds voiceover and AI-generated text overlay (without output)"""
+        if job.overlay:
+            overlay_text = job.overlay
+            logger.info(f"Using AI-generated overlay: {overlay_text}")
+        else:
+            # Fallback to product name if no overlay was generated
+            overlay_text = (job.video_data.get('productInfo') or {}).get('name') or 'Product'
+            logger.warning(f"No overlay text generated, using product name: {overlay_text}")
+
+        # Determine font size and wrap text if needed
+        text_length = len(overlay_text)
+
+        if text_length > 70:
+            if text_length > 105:
+                # Split into 3 lines
+                fontsize = 24
+                display_text = self._wrap_text(overlay_text, 3)
+            else:
+                # Split into 2 lines
+                fontsize = 28
+                display_text = self._wrap_text(overlay_text, 2)
+        else:
+            # Single line
+            display_text = overlay_text
+            fontsize = 38 if text_length <= 50 else 32
+
+        logger.info(f"Text overlay: {text_length} chars, fontsize={fontsize}")
+
+        # Escape text for ffmpeg
+        escaped_text = display_text.replace("'", "'\\''").replace(":", "\\:")
+
+        # Replace audio with the normalized voiceover and draw text with line spacing
+        drawtext = f"drawtext=text='{escaped_text}':fontsize={fontsize}:fontcolor=white:x=(w-text_w)/2:y=60:box=1:boxcolor=black@0.85:boxborderw=25:line_spacing=12"
+        return ['ffmpeg'] + self._encoder_global_args() + self._encoder_input_args() + [
+            '-i', str(job.output_dir / 'merged_temp.mp4'),
+            '-i', str(job.voiceover),
+            '-map', '0:v', '-map', '1:a',
+            '-vf', self._encoder_filter(drawtext),
+            '-af', 'aresample=48000,aformat=channel_layouts=stereo'
+        ] + self._encoder_output_args() + [
+            '-c:a', 'aac', '-b:a', '192k',
+            '-shortest'
+        ]
+
+    def render_final_video(self, job: Job) -> bool:
+        """Add voiceover and AI-generated text overlay to merged video in a single encode"""
         try:
-            logger.info("Adding text overlay...")
+            logger.info("Adding audio and text overlay...")
 
-            # Read AI-generated overlay text from file
-            overlay_file = self.scripts_dir / 'text_overlay.txt'
-
-            if overlay_file.exists():
-                with open(overlay_file, 'r', encoding='utf-8') as f:
-                    overlay_text = f.read().strip()
-                logger.info(f"Using AI-generated overlay: {overlay_text}")
-            else:
-                # Fallback to product name if overlay file doesn't exist
-                overlay_text = video_data.get('productInfo', {}).get('name', 'Product')
-                logger.warning(f"Overlay file not found, using product name: {overlay_text}")
-
-            # Get video dimensions
-            result = subprocess.run([
-                'ffprobe', '-v', 'error',
-                '-select_streams', 'v:0',
-                '-show_entries', 'stream=width,height',
-                '-of', 'csv=s=x:p=0',
-                str(self.output_dir / 'merged_with_audio.mp4')
-            ], capture_output=True, text=True, check=True)
-
-            dimensions = result.stdout.strip()
-            logger.info(f"Video dimensions: {dimensions}")
-
-            # Determine font size and wrap text if needed
-            text_length = len(overlay_text)
-
-            if text_length > 70:
-                if text_length > 105:
-                    # Split into 3 lines
-                    fontsize = 24
-                    display_text = self._wrap_text(overlay_text, 3)
-                else:
-                    # Split into 2 lines
-                    fontsize = 28
-                    display_text = self._wrap_text(overlay_text, 2)
-            else:
-                # Single line
-                display_text = overlay_text
-                fontsize = 38 if text_length <= 50 else 32
+            returncode, stderr_tail = self._run_ffmpeg(self._final_video_command(job) + [
+                '-movflags', '+faststart',
+                '-y', str(job.output_dir / 'final_merged_video.mp4')
+            ])
+            if returncode != 0:
+                logger.error(f"Error rendering final video (ffmpeg exit {returncode}): {stderr_tail}")
+                return False
 
-            logger.info(f"Text overlay: {text_length} chars, fontsize={fontsize}")
+            logger.info("Audio and text overlay added successfully")
+            return True
 
-            # Escape text for ffmpeg
-            escaped_text = display_text.replace("'", "'\\''").replace(":", "\\:")
+        except Exception as e:
+            logger.error(f"Error rendering final video: {e}")
+            return False
 
-            # Add text overlay with line spacing
-            subprocess.run([
-                'ffmpeg',
-                '-i', str(self.output_dir / 'merged_with_audio.mp4'),
-                '-vf', f"drawtext=text='{escaped_text}':fontsize={fontsize}:fontcolor=white:x=(w-text_w)/2:y=60:box=1:boxcolor=black@0.85:boxborderw=25:line_spacing=12",
-                '-c:a', 'copy',
-                '-y', str(self.output_dir / 'final_merged_video.mp4')
-            ], check=True, capture_output=True)
+    def render_and_upload(self, job: Job) -> bool:
+        """Render the final video as fragmented MP4 and stream it straight into an R2 multipart upload"""
+        try:
+            logger.info("Rendering and streaming final video to Cloudflare R2...")
+
+            r2_key = self._r2_key(job.product_id, job.video_data)
+            command = self._final_video_command(job) + [
+                '-movflags', '+frag_keyframe+empty_moov+default_base_moof',
+                '-f', 'mp4', 'pipe:1'
+            ]
+
+            process, stderr_tail = self._start_ffmpeg(command, stdout=subprocess.PIPE)
+            try:
+                self.r2_client.upload_fileobj(
+                    process.stdout,
+                    self.r2_bucket,
+                    r2_key,
+                    ExtraArgs=self._r2_extra_args(job.product_id),
+                    Config=self.r2_transfer_config
+                )
+            finally:
+                # Closing stdout stops ffmpeg (SIGPIPE) if the upload failed part-way
+                process.stdout.close()
+                returncode = process.wait()
+
+            if returncode != 0:
+                # The upload completed with a truncated stream; don't leave it behind
+                self.r2_client.delete_object(Bucket=self.r2_bucket, Key=r2_key)
+                logger.error(f"ffmpeg failed while streaming (exit {returncode}): {stderr_tail()}")
+                return False
 
-            logger.info("Text overlay added successfully")
+            job.r2_url = self._r2_public_url(r2_key)
+            logger.info(f"Video uploaded to R2: {job.r2_url}")
             return True
 
         except Exception as e:
-            logger.error(f"Error adding text overlay: {e}")
+            logger.error(f"Error rendering/uploading final video: {e}")
             return False
 
     def _wrap_text(self, text: str, lines: int) -> str:
         """Wrap text into multiple lines for better display"""
-        length = len(text)
-        chunk_size = length // lines
-
-        result_lines = []
-        current_pos = 0
-
-        for i in range(lines - 1):
-            # Find best split point near chunk boundary
-            target = current_pos + chunk_size
-            best_split = target
-
-            # Search for space/comma/dash near target
-            for offset in range(20):
-                for pos in [target + offset, target - offset]:
-                    if pos < length and pos > current_pos:
-                        if text[pos] in ' ,-':
-                            best_split = pos
-                            break
-                if best_split != target:
-                    break
-
-            result_lines.append(text[current_pos:best_split].strip())
-            current_pos = best_split
-
-        # Add remaining text as last line
-        result_lines.append(text[current_pos:].strip())
-
-        return '\\n'.join(result_lines)
+        width = max(1, len(text) // lines + 5)
+        parts = textwrap.wrap(text, width=width, break_long_words=False, break_on_hyphens=True)
+
+        # Any overflow goes on the last line
+        if len(parts) > lines:
+            parts = parts[:lines - 1] + [' '.join(parts[lines - 1:])]
+
+        return '\\n'.join(parts)
+
+    def _r2_key(self, product_id: int, video_data: Dict) -> str:
+        """Generate R2 key"""
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        product_name_slug = (video_data.get('productInfo') or {}).get('name') or 'product'
+        # Clean filename
+        product_name_slug = ''.join(c if c.isalnum() or c in '-_' else '_' for c in product_name_slug)[:50]
+
+        return f"merged_videos/{timestamp}_product_{product_id}_{product_name_slug}.mp4"
+
+    def _r2_public_url(self, r2_key: str) -> str:
+        """Generate public URL"""
+        return f"https://pub-09ecd227972848afb3d86c1f7f2b57b1.r2.dev/{r2_key}"
+
+    def _r2_extra_args(self, product_id: int) -> Dict:
+        """Object headers and metadata for an uploaded video"""
+        return {
+            'ContentType': 'video/mp4',
+            'Metadata': {
+                'product_id': str(product_id),
+                'processed_at': datetime.now().isoformat()
+            }
+        }
 
     def upload_to_r2(self, video_path: Path, product_id: int, video_data: Dict) -> Optional[str]:
-        """Upload video to Cloudflare R2"""
+        """Upload video file to Cloudflare R2 (streamed from disk by the transfer manager)"""
         try:
             logger.info("Uploading to Cloudflare R2...")
 
-            # Generate R2 key
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            product_name_slug = video_data.get('productInfo', {}).get('name', 'product')
-            # Clean filename
-            product_name_slug = ''.join(c if c.isalnum() or c in '-_' else '_' for c in product_name_slug)[:50]
-
-            r2_key = f"merged_videos/{timestamp}_product_{product_id}_{product_name_slug}.mp4"
+            r2_key = self._r2_key(product_id, video_data)
 
             # Upload to R2
-            with open(video_path, 'rb') as f:
-                self.r2_client.put_object(
-                    Bucket=self.r2_bucket,
-                    Key=r2_key,
-                    Body=f,
-                    ContentType='video/mp4',
-                    Metadata={
-                        'product_id': str(product_id),
-                        'processed_at': datetime.now().isoformat()
-                    }
-                )
+            self.r2_client.upload_file(
+                str(video_path),
+                self.r2_bucket,
+                r2_key,
+                ExtraArgs=self._r2_extra_args(product_id),
+                Config=self.r2_transfer_config
+            )
 
-            # Generate public URL
-            r2_public_url = f"https://pub-09ecd227972848afb3d86c1f7f2b57b1.r2.dev/{r2_key}"
+            r2_public_url = self._r2_public_url(r2_key)
 
             logger.info(f"Video uploaded to R2: {r2_public_url}")
             return r2_public_url
@@ -673,25 +1168,9 @@ class VideoProcessor:
             logger.error(f"Error uploading to R2: {e}")
             return None
 
-    def run(self):
-        """Main processing loop"""
-        logger.info("Starting video processing...")
-
-        # Setup directories
-        self.setup_directories()
-
-        # Get pending products
-        products = self.get_pending_products()
-
-        if not products:
-            logger.info("No pending products to process")
-            return
-
-        # Process each product
-        success_count = 0
-        failed_count = 0
+    def _queue_valid_products(self, products: List[Dict], ready: deque) -> int:
+        """Validate claimed products and queue the processable ones; returns number skipped"""
         skipped_count = 0
-
         for product in products:
             product_id = product['id']
             video_data = product['video_data']
@@ -713,24 +1192,140 @@ class VideoProcessor:
                 skipped_count += 1
                 continue
 
-            # Clean up before processing each product
-            self.cleanup_directories()
+            product_info = video_data.get('productInfo')
+            if product_info is not None and not isinstance(product_info, dict):
+                logger.warning(f"⚠️  Product {product_id}: productInfo is not an object - skipping")
+                skipped_count += 1
+                continue
 
-            # Process product
-            r2_url = self.process_product(product_id, video_data)
+            ready.append((product_id, video_data))
 
-            if r2_url:
-                # Update database
-                try:
-                    self.update_merge_status(product_id, r2_url)
-                    success_count += 1
-                    logger.info(f"✅ Product {product_id} processed successfully")
-                except Exception as e:
-                    logger.error(f"Failed to update database for product {product_id}: {e}")
-                    failed_count += 1
-            else:
-                failed_count += 1
-                logger.error(f"❌ Failed to process product {product_id}")
+        return skipped_count
+
+    def run(self):
+        """Main processing loop: products flow through a pipeline of I/O, CPU and DB stages"""
+        logger.info("Starting video processing...")
+
+        # Claim the first batch of pending products
+        products = self.claim_pending_products(self.claim_batch_size)
+        claims_renewed_at = time.monotonic()
+
+        if not products:
+            logger.info("No pending products to process")
+            return
+
+        # Process each product
+        success_count = 0
+        failed_count = 0
+        skipped_count = 0
+        total_count = 0
+
+        ready = deque()
+
+        active_jobs: Dict[int, Job] = {}
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_jobs, thread_name_prefix='io') as io_pool, \
+                    ThreadPoolExecutor(max_workers=self.cpu_workers, thread_name_prefix='cpu') as cpu_pool, \
+                    ThreadPoolExecutor(max_workers=self.db_workers, thread_name_prefix='db') as db_pool:
+                if self.stream_upload:
+                    output_stages = [[(cpu_pool, self._stage_publish)]]
+                else:
+                    output_stages = [[(cpu_pool, self._stage_render)], [(io_pool, self._stage_upload)]]
+
+                # Each stage lists branches that run concurrently; a job moves on once all of them finish
+                stages = [
+                    [(io_pool, self._stage_download)],
+                    # Narration works from the probed clip durations, so HF/TTS latency hides behind the merge
+                    [(cpu_pool, self._stage_edit), (io_pool, self._stage_narrate)],
+                    *output_stages,
+                ]
+
+                # Jobs report back here after every branch; the dispatcher routes them to the next pools
+                done: queue.Queue = queue.Queue()
+                in_flight = 0
+
+                while True:
+                    if products is not None:
+                        total_count += len(products)
+                        exhausted = len(products) < self.claim_batch_size
+                        skipped_count += self._queue_valid_products(products, ready)
+                        products = None
+
+                    # Renew our claims at half the timeout, so products that are queued, in progress or
+                    # waiting for their batched merge_status write can't be claimed by another run
+                    if time.monotonic() - claims_renewed_at > self.claim_timeout_minutes * 30:
+                        with self._pending_updates_lock:
+                            buffered = [u[0] for u in self._pending_updates]
+                        try:
+                            self.refresh_claims([product_id for product_id, _ in ready] + list(active_jobs) + buffered)
+                            claims_renewed_at = time.monotonic()
+                        except Exception:
+                            # Already logged; retried on the next pass
+                            pass
+
+                    # Claim the next batch once the queue drops below one batch of free slots
+                    if len(ready) < self.max_jobs and not exhausted:
+                        try:
+                            products = self.claim_pending_products(self.claim_batch_size)
+                        except Exception:
+                            logger.error("Stopping claims, finishing products already in progress")
+                            products = []
+                        continue
+
+                    # Admit new products while there is room, bounding disk usage and queue depth
+                    while ready and in_flight < self.max_jobs:
+                        product_id, video_data = ready.popleft()
+                        product_name = (video_data.get('productInfo') or {}).get('name') or 'Unknown'
+                        logger.info(f"Processing product {product_id}: {product_name}")
+                        job = self.create_job(product_id, video_data)
+                        active_jobs[job.product_id] = job
+                        self._submit_stage(job, stages[job.stage], done)
+                        in_flight += 1
+
+                    if not in_flight:
+                        break
+
+                    # Wake up periodically so claims are renewed even while every job is busy
+                    try:
+                        job = done.get(timeout=60)
+                    except queue.Empty:
+                        continue
+                    job.pending_branches -= 1
+                    if job.pending_branches:
+                        continue
+
+                    if not job.failed and job.stage < len(stages) - 1:
+                        job.stage += 1
+                        self._submit_stage(job, stages[job.stage], done)
+                        continue
+
+                    in_flight -= 1
+                    del active_jobs[job.product_id]
+                    self.release_job(job)
+
+                    if job.failed:
+                        failed_count += 1
+                        logger.error(f"❌ Failed to process product {job.product_id}")
+                    else:
+                        success_count += 1
+                        logger.info(f"✅ Product {job.product_id} processed successfully")
+                        # Mark merged in batches; the write runs on the db pool so the dispatcher never waits on it
+                        if self.update_merge_status(job.product_id, job.r2_url):
+                            db_pool.submit(self._flush_merge_updates_in_background)
+        finally:
+            # Jobs cut short by an error still get their working directory removed
+            for job in active_jobs.values():
+                self.release_job(job)
+
+            # Write any merge_status updates still buffered, even when the loop above failed
+            try:
+                self.flush_merge_updates()
+            except Exception as e:
+                # Uploaded but not marked merged, so these will be processed again
+                unrecorded = [u[0] for u in self._pending_updates]
+                logger.error(f"Failed to update database for {len(unrecorded)} products: {unrecorded}: {e}")
+                success_count -= len(unrecorded)
+                failed_count += len(unrecorded)
 
         # Summary
         logger.info("=" * 50)
@@ -738,7 +1333,7 @@ class VideoProcessor:
         logger.info(f"Success: {success_count}")
         logger.info(f"Failed: {failed_count}")
         logger.info(f"Skipped (invalid data): {skipped_count}")
-        logger.info(f"Total: {len(products)}")
+        logger.info(f"Total: {total_count}")
         logger.info("=" * 50)
 
 
@@ -43,7 +43,7 @@ echo "All required environment variables are set."
 echo ""
 
 # Check if Python dependencies are installed
-if ! python3 -c "import psycopg2, boto3" 2>/dev/null; then
+if ! python3 -c "import psycopg2, boto3, requests, edge_tts" 2>/dev/null; then
     echo "Installing Python dependencies..."
     pip3 install -r requirements.txt
 fi